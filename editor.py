@@ -6,6 +6,11 @@ import tkinter as tk
 from tkinter import simpledialog, filedialog, messagebox, ttk
 import json
 
+try:
+    import orjson  # optional: faster map save/load
+except ImportError:
+    orjson = None
+
 WIDTH, HEIGHT = 1000, 700
 SYMBOL_TYPES = ['slow', 'no_entry']
 
@@ -42,6 +47,9 @@ class Editor:
         self.start = None
         self.current_rect = None
         self.selected_item = None
+        self.selected_items = ()
+        # Python-side index of canvas items, so selection/drag don't go back to tag searches
+        self.item_owner = {}  # canvas item id -> all canvas item ids of its map object
 
         self.canvas.bind('<ButtonPress-1>', self.on_press)
         self.canvas.bind('<B1-Motion>', self.on_drag)
@@ -52,6 +60,10 @@ class Editor:
         self.id_counter += 1
         return i
 
+    def register_items(self, *items):
+        for item in items:
+            self.item_owner[item] = items
+
     def set_big(self): self.mode = 'big_road'
     def set_small(self): self.mode = 'small_road'
     def add_hub_mode(self): self.mode = 'hub'
@@ -71,26 +83,31 @@ class Editor:
             rate = simpledialog.askinteger('Spawn rate', 'Cars per minute:', parent=self.master, minvalue=0, initialvalue=3)
             hid = self.new_id()
             r = 14
-            self.canvas.create_oval(x - r, y - r, x + r, y + r, fill='gold', outline='black', width=2, tags=(f'hub{hid}',))
-            self.canvas.create_text(x, y, text=name, tags=(f'hub_label{hid}',))
+            oval = self.canvas.create_oval(x - r, y - r, x + r, y + r, fill='gold', outline='black', width=2, tags=(f'hub{hid}',))
+            label = self.canvas.create_text(x, y, text=name, tags=(f'hub_label{hid}',))
+            self.register_items(oval, label)
             self.hubs.append({'id': hid, 'x': x, 'y': y, 'name': name, 'rate': rate})
         elif self.mode == 'light':
             lid = self.new_id()
             cycle = simpledialog.askinteger('Cycle secs', 'Green/Red cycle seconds (green first):', parent=self.master, minvalue=1,initialvalue=6)
-            self.canvas.create_rectangle(x - 6, y - 6, x + 6, y + 6, fill='red', tags=(f'light{lid}',))
+            item = self.canvas.create_rectangle(x - 6, y - 6, x + 6, y + 6, fill='red', tags=(f'light{lid}',))
+            self.register_items(item)
             self.lights.append({'id': lid, 'x': x, 'y': y, 'green': cycle, 'red': cycle, 'offset': 0})
         elif self.mode == 'symbol':
             sid = self.new_id()
             stype = self.symbol_type_var.get()
             if stype == 'slow':
-                self.canvas.create_rectangle(x - 10, y - 6, x + 10, y + 6, fill='gray', tags=(f'symbol{sid}',))
+                item = self.canvas.create_rectangle(x - 10, y - 6, x + 10, y + 6, fill='gray', tags=(f'symbol{sid}',))
             else:
-                self.canvas.create_polygon(x, y - 10, x - 8, y + 6, x + 8, y + 6, fill='sandybrown', tags=(f'symbol{sid}',))
+                item = self.canvas.create_polygon(x, y - 10, x - 8, y + 6, x + 8, y + 6, fill='sandybrown', tags=(f'symbol{sid}',))
+            self.register_items(item)
             self.symbols.append({'id': sid, 'x': x, 'y': y, 'type': stype})
         elif self.mode == 'select':
             item = self.canvas.find_closest(x, y)
             if item:
                 self.selected_item = item[0]
+                # move every canvas item of the same map object (e.g. hub + its label)
+                self.selected_items = self.item_owner.get(self.selected_item, (self.selected_item,))
                 self.sel_start = (x, y)
 
     def on_drag(self, event):
@@ -101,7 +118,8 @@ class Editor:
         elif self.mode == 'select' and self.selected_item:
             dx = x - self.sel_start[0]
             dy = y - self.sel_start[1]
-            self.canvas.move(self.selected_item, dx, dy)
+            for item in self.selected_items:
+                self.canvas.move(item, dx, dy)
             self.sel_start = (x, y)
 
     def on_release(self, event):
@@ -116,46 +134,65 @@ class Editor:
                 typ = 'big' if self.mode == 'big_road' else 'small'
                 rid = self.new_id()
                 self.canvas.itemconfig(self.current_rect, tags=(f'road{rid}',))
+                self.register_items(self.current_rect)
                 self.roads.append({'id': rid, 'x': x, 'y': y, 'w': w, 'h': h, 'type': typ})
             self.current_rect = None
             self.start = None
         elif self.mode == 'select':
             self.selected_item = None
+            self.selected_items = ()
 
     def save_map(self):
         filepath = filedialog.asksaveasfilename(defaultextension='.json', filetypes=[('JSON','*.json')])
         if not filepath:
             return
         data = {'roads': self.roads, 'hubs': self.hubs, 'lights': self.lights, 'symbols': self.symbols}
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=2)
+        if orjson is not None:
+            with open(filepath, 'wb') as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        else:
+            with open(filepath, 'w') as f:
+                json.dump(data, f, indent=2)
         messagebox.showinfo('Saved', f'Map saved to {filepath}')
 
     def load_map(self):
         filepath = filedialog.askopenfilename(filetypes=[('JSON','*.json')])
         if not filepath:
             return
-        with open(filepath) as f:
-            data = json.load(f)
+        if orjson is not None:
+            with open(filepath, 'rb') as f:
+                data = orjson.loads(f.read())
+        else:
+            with open(filepath) as f:
+                data = json.load(f)
         self.roads = data.get('roads', [])
         self.hubs = data.get('hubs', [])
         self.lights = data.get('lights', [])
         self.symbols = data.get('symbols', [])
+        # keep new ids clear of the loaded ones
+        loaded_ids = [o['id'] for o in self.roads + self.hubs + self.lights + self.symbols
+                      if isinstance(o.get('id'), int)]
+        self.id_counter = max(loaded_ids, default=0) + 1
         self.canvas.delete('all')
+        self.item_owner = {}
         for r in self.roads:
-            self.canvas.create_rectangle(r['x'], r['y'], r['x']+r['w'], r['y']+r['h'], fill='black', tags=(f'road{r["id"]}',))
+            item = self.canvas.create_rectangle(r['x'], r['y'], r['x']+r['w'], r['y']+r['h'], fill='black', tags=(f'road{r["id"]}',))
+            self.register_items(item)
         for h in self.hubs:
             r = 14
-            self.canvas.create_oval(h['x']-r, h['y']-r, h['x']+r, h['y']+r, fill='gold', outline='black', width=2, tags=(f'hub{h["id"]}',))
-            self.canvas.create_text(h['x'], h['y'], text=h.get('name',''))
+            oval = self.canvas.create_oval(h['x']-r, h['y']-r, h['x']+r, h['y']+r, fill='gold', outline='black', width=2, tags=(f'hub{h["id"]}',))
+            label = self.canvas.create_text(h['x'], h['y'], text=h.get('name',''))
+            self.register_items(oval, label)
         for l in self.lights:
-            self.canvas.create_rectangle(l['x']-6, l['y']-6, l['x']+6, l['y']+6, fill='red')
+            item = self.canvas.create_rectangle(l['x']-6, l['y']-6, l['x']+6, l['y']+6, fill='red')
+            self.register_items(item)
         for s in self.symbols:
             if s.get('type') == 'slow':
-                self.canvas.create_rectangle(s['x']-10, s['y']-6, s['x']+10, s['y']+6, fill='gray')
+                item = self.canvas.create_rectangle(s['x']-10, s['y']-6, s['x']+10, s['y']+6, fill='gray')
             else:
                 x, y = s['x'], s['y']
-                self.canvas.create_polygon(x, y-10, x-8, y+6, x+8, y+6, fill='sandybrown')
+                item = self.canvas.create_polygon(x, y-10, x-8, y+6, x+8, y+6, fill='sandybrown')
+            self.register_items(item)
         messagebox.showinfo('Loaded', 'Map loaded')
 
 
@@ -2,14 +2,45 @@
 # map_utils.py
 # Geometric road graph builder: roads -> nodes placed on rectangles and intersections
 # Nodes are strings for road points and ints for hub ids (keeps compatibility).
-# Exposes: load_map_data(path), build_graph(mapdata), find_path(edges, start_id, goal_id, traffic_counts=None)
+# Exposes: load_map_data(path), build_graph(mapdata), build_csr(nodes, edges),
+#          find_path(nodes, edges, start_id, goal_id, traffic_counts=None, csr=None)
 
 import math
 import json
 import heapq
+import itertools
 from collections import defaultdict
 
+try:
+    # optional: faster JSON parsing for map files
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    # optional: JIT-compiled A* over the CSR arrays
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    # optional: KD-tree for snapping hubs to the nearest road node
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+INF = float('inf')
+CLOSE_NODE_DIST = 40.0  # road nodes closer than this get linked in build_graph
+
 def load_map_data(path):
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
     with open(path, 'r') as f:
         return json.load(f)
 
@@ -25,12 +56,75 @@ def _rect_overlap(a, b):
         return {'x': x1, 'y': y1, 'w': (x2 - x1), 'h': (y2 - y1)}
     return None
 
+def _overlapping_pairs(rects):
+    """Return sorted (i, j) index pairs (i < j) of rects that overlap (same test as _rect_overlap).
+    x-axis sweep: only rects whose x-extent is still open are compared against the next one.
+    """
+    boxes = [(r['x'], r['y'], r['x'] + r['w'], r['y'] + r['h']) for r in rects]
+    order = sorted(range(len(boxes)), key=lambda k: boxes[k][0])
+    active = []
+    pairs = []
+    for k in order:
+        x1, y1, x2, y2 = boxes[k]
+        if x2 <= x1 or y2 <= y1:
+            continue  # degenerate rect never overlaps anything
+        active = [m for m in active if boxes[m][2] > x1]
+        for m in active:
+            bx1, by1, bx2, by2 = boxes[m]
+            if bx1 < x2 and by1 < y2 and y1 < by2:
+                pairs.append((m, k) if m < k else (k, m))
+        active.append(k)
+    pairs.sort()  # original road-list order, so node/edge insertion order is unchanged
+    return pairs
+
+def _nearest_finder(points, max_dist):
+    """Return f((x,y)) -> index of the nearest point within max_dist (inclusive), or None.
+    Uses scipy's cKDTree when available, otherwise a uniform grid with cell size max_dist
+    (so only the 3x3 neighbourhood can hold a hit). Either way ties go to the lowest index.
+    """
+    if not points:
+        return lambda pt: None
+    if cKDTree is not None:
+        tree = cKDTree(np.asarray(points, dtype=float))
+        bound = math.nextafter(max_dist, INF)  # cKDTree's bound is exclusive
+
+        def query(pt):
+            d, idx = tree.query(pt, k=1, distance_upper_bound=bound)
+            if idx >= len(points):
+                return None
+            # cKDTree picks arbitrarily among equal distances: rescan that radius for the lowest index
+            near = tree.query_ball_point(pt, math.nextafter(d, INF))
+            return min(near, key=lambda i: (_dist(pt, points[i]), i))
+        return query
+
+    cell = max_dist if max_dist > 0 else 1.0
+    grid = defaultdict(list)
+    for i, (x, y) in enumerate(points):
+        grid[(int(x // cell), int(y // cell))].append(i)
+
+    def query(pt):
+        cx, cy = int(pt[0] // cell), int(pt[1] // cell)
+        best = None
+        bd = INF
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for i in grid.get((cx + dx, cy + dy), ()):
+                    d = _dist(pt, points[i])
+                    if d < bd or (d == bd and i < best):
+                        bd = d; best = i
+        return best if bd <= max_dist else None
+    return query
+
 def _mid(pt):
     return (pt[0] + pt[1]) / 2.0
 
 def _dist(a, b):
     return math.hypot(a[0] - b[0], a[1] - b[1])
 
+# Version of build_graph's output; simulator.py stores it in its pickled graph cache.
+# Bump it whenever graph construction changes so stale <map>.json.cache files get rebuilt.
+GRAPH_CACHE_VERSION = 2
+
 def build_graph(mapdata, hub_snap_dist=80):
     """
     Build a graph where:
@@ -47,6 +141,7 @@ def build_graph(mapdata, hub_snap_dist=80):
 
     nodes = {}     # node_id -> (x,y)
     node_roads = defaultdict(list)  # node_id -> list of road ids it belongs to
+    road_to_node_ids = {}  # road id -> [(node_id, (x,y)), ...] of its primary nodes, in order
     edges = defaultdict(list)
 
     # 1) Create primary nodes for each road: left/top, mid, right/bottom depending on orientation
@@ -65,6 +160,7 @@ def build_graph(mapdata, hub_snap_dist=80):
             nodes[f"r{rid}_L"] = left
             nodes[f"r{rid}_M"] = mid
             nodes[f"r{rid}_R"] = right
+            road_to_node_ids[rid] = [(f"r{rid}_L", left), (f"r{rid}_M", mid), (f"r{rid}_R", right)]
             node_roads[f"r{rid}_L"].append(rid)
             node_roads[f"r{rid}_M"].append(rid)
             node_roads[f"r{rid}_R"].append(rid)
@@ -83,6 +179,7 @@ def build_graph(mapdata, hub_snap_dist=80):
             nodes[f"r{rid}_T"] = top
             nodes[f"r{rid}_M"] = mid
             nodes[f"r{rid}_B"] = bottom
+            road_to_node_ids[rid] = [(f"r{rid}_T", top), (f"r{rid}_M", mid), (f"r{rid}_B", bottom)]
             node_roads[f"r{rid}_T"].append(rid)
             node_roads[f"r{rid}_M"].append(rid)
             node_roads[f"r{rid}_B"].append(rid)
@@ -95,75 +192,83 @@ def build_graph(mapdata, hub_snap_dist=80):
 
     # 2) Detect rectangle intersections and create nodes at their overlap centers
     #    also link intersection nodes to the road nodes of both roads
-    for i in range(len(roads)):
-        for j in range(i + 1, len(roads)):
-            a = roads[i]
-            b = roads[j]
-            ov = _rect_overlap(a, b)
-            if ov:
-                # intersection center
-                ix = ov['x'] + ov['w'] / 2.0
-                iy = ov['y'] + ov['h'] / 2.0
-                inter_id = f"i{a['id']}_{b['id']}"
-                nodes[inter_id] = (ix, iy)
-                node_roads[inter_id].append(a['id'])
-                node_roads[inter_id].append(b['id'])
-                # Connect intersection to the nearest nodes on each road (which we created earlier)
-                # Find road-node ids that belong to road a and road b
-                road_a_nodes = [nid for nid in nodes.keys() if nid.startswith(f"r{a['id']}_")]
-                road_b_nodes = [nid for nid in nodes.keys() if nid.startswith(f"r{b['id']}_")]
-                # connect to closest from each list
-                best_a = None; best_da = float('inf')
-                for nid in road_a_nodes:
-                    d = _dist(nodes[nid], (ix, iy))
-                    if d < best_da:
-                        best_da = d; best_a = nid
-                best_b = None; best_db = float('inf')
-                for nid in road_b_nodes:
-                    d = _dist(nodes[nid], (ix, iy))
-                    if d < best_db:
-                        best_db = d; best_b = nid
-                if best_a:
-                    edges[inter_id].append((best_a, best_da))
-                    edges[best_a].append((inter_id, best_da))
-                if best_b:
-                    edges[inter_id].append((best_b, best_db))
-                    edges[best_b].append((inter_id, best_db))
+    #    Candidate pairs come from a sweep along x: roads sorted by left edge, keeping an
+    #    active list of roads whose right edge has not been passed yet.
+    for i, j in _overlapping_pairs(roads):
+        a = roads[i]
+        b = roads[j]
+        ov = _rect_overlap(a, b)
+        # intersection center
+        ix = ov['x'] + ov['w'] / 2.0
+        iy = ov['y'] + ov['h'] / 2.0
+        inter_id = f"i{a['id']}_{b['id']}"
+        nodes[inter_id] = (ix, iy)
+        node_roads[inter_id].append(a['id'])
+        node_roads[inter_id].append(b['id'])
+        # Connect intersection to the nearest nodes on each road (which we created earlier)
+        # Road-node ids of road a and road b were recorded in step 1
+        road_a_nodes = road_to_node_ids[a['id']]
+        road_b_nodes = road_to_node_ids[b['id']]
+        # connect to closest from each list (first one wins on ties)
+        ip = (ix, iy)
+        best_a, pa = min(road_a_nodes, key=lambda e: _dist(e[1], ip))
+        best_b, pb = min(road_b_nodes, key=lambda e: _dist(e[1], ip))
+        best_da = _dist(pa, ip)
+        best_db = _dist(pb, ip)
+        edges[inter_id].append((best_a, best_da))
+        edges[best_a].append((inter_id, best_da))
+        edges[inter_id].append((best_b, best_db))
+        edges[best_b].append((inter_id, best_db))
 
     # 3) Connect road endpoints across short gaps: if two road nodes are very close (touching),
     #    create an edge. This helps when a road's L/M/R may be close to another road's node.
+    #    Nodes are bucketed into a uniform grid with cell size == threshold, so only the
+    #    3x3 neighbourhood of each cell has to be checked instead of every pair.
     all_node_ids = list(nodes.keys())
-    for i in range(len(all_node_ids)):
-        for j in range(i + 1, len(all_node_ids)):
-            n1 = all_node_ids[i]
-            n2 = all_node_ids[j]
-            # skip if already connected
-            already = any(nb == n2 for nb, _ in edges.get(n1, []))
-            if already:
-                continue
-            d = _dist(nodes[n1], nodes[n2])
-            # threshold: if nodes are physically very close (e.g., share corner/intersection)
-            if d < 40.0:
-                edges[n1].append((n2, d))
-                edges[n2].append((n1, d))
+    cell = CLOSE_NODE_DIST
+    grid = defaultdict(list)  # (cx, cy) -> node indices
+    for i, nid in enumerate(all_node_ids):
+        x, y = nodes[nid]
+        grid[(int(x // cell), int(y // cell))].append(i)
+    pairs = []
+    for (cx, cy), members in grid.items():
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                others = grid.get((cx + dx, cy + dy))
+                if not others:
+                    continue
+                for i in members:
+                    for j in others:
+                        if i < j:  # each unordered pair once
+                            pairs.append((i, j))
+    pairs.sort()  # keep the original pair order so edge lists come out the same
+    for i, j in pairs:
+        n1 = all_node_ids[i]
+        n2 = all_node_ids[j]
+        # skip if already connected
+        already = any(nb == n2 for nb, _ in edges.get(n1, []))
+        if already:
+            continue
+        d = _dist(nodes[n1], nodes[n2])
+        # threshold: if nodes are physically very close (e.g., share corner/intersection)
+        if d < CLOSE_NODE_DIST:
+            edges[n1].append((n2, d))
+            edges[n2].append((n1, d))
 
     # 4) Hubs: add hub ids (integers) as nodes and connect to nearest road node (snap)
+    #    Only road-derived nodes (roads + intersections) are snap targets, never other hubs.
+    road_node_ids = list(nodes.keys())
+    nearest = _nearest_finder([nodes[nid] for nid in road_node_ids], hub_snap_dist)
     for h in hubs:
         hid = h['id']  # integer id
         hx, hy = h['x'], h['y']
         nodes[hid] = (hx, hy)
         edges[hid] = []
-        # find nearest road-derived node
-        best = None; bd = float('inf')
-        for nid, (nx, ny) in nodes.items():
-            if nid == hid:
-                continue
-            # prefer road nodes (strings starting with 'r' or 'i') over other hubs
-            d = _dist((hx, hy), (nx, ny))
-            if d < bd:
-                bd = d; best = nid
+        k = nearest((hx, hy))
         # connect if within snap distance
-        if best is not None and bd <= hub_snap_dist:
+        if k is not None:
+            best = road_node_ids[k]
+            bd = _dist((hx, hy), nodes[best])
             edges[hid].append((best, bd))
             edges[best].append((hid, bd))
         # otherwise still keep hub isolated (simulator won't spawn until connected)
@@ -172,32 +277,205 @@ def build_graph(mapdata, hub_snap_dist=80):
     return nodes, dict(edges)
 
 
-def find_path(edges, start_id, goal_id, traffic_counts=None):
+def build_csr(nodes, edges):
+    """
+    Flatten the adjacency dict into index-based arrays (CSR layout) for the pathfinder.
+    Neighbours of node index u are nbr_idx[offsets[u]:offsets[u+1]] with weights in nbr_w.
+    Build once per map; the result only depends on (nodes, edges).
+    Returns: (node_ids, node_index, offsets, nbr_idx, nbr_w, node_xy)
+      node_ids: index -> node id, node_index: node id -> index, node_xy: index -> (x,y)
+    """
+    node_ids = list(nodes.keys())
+    node_index = {nid: i for i, nid in enumerate(node_ids)}
+    node_xy = [nodes[nid] for nid in node_ids]
+    offsets = [0]
+    nbr_idx = []
+    nbr_w = []
+    for nid in node_ids:
+        for nbr, w in edges.get(nid, []):
+            nbr_idx.append(node_index[nbr])
+            nbr_w.append(w)
+        offsets.append(len(nbr_idx))
+    if njit is not None:
+        offsets = np.array(offsets, dtype=np.int32)
+        nbr_idx = np.array(nbr_idx, dtype=np.int32)
+        nbr_w = np.array(nbr_w, dtype=np.float64)
+        node_xy = np.array(node_xy, dtype=np.float64).reshape(-1, 2)
+    return node_ids, node_index, offsets, nbr_idx, nbr_w, node_xy
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _heap_push(keys, vals, size, key, val):
+        i = size
+        keys[i] = key
+        vals[i] = val
+        while i > 0:
+            parent = (i - 1) // 2
+            if keys[parent] <= keys[i]:
+                break
+            keys[i], keys[parent] = keys[parent], keys[i]
+            vals[i], vals[parent] = vals[parent], vals[i]
+            i = parent
+        return size + 1
+
+    @njit(cache=True)
+    def _heap_pop(keys, vals, size):
+        """Remove the root; caller reads keys[0]/vals[0] first. Returns new size."""
+        size -= 1
+        keys[0] = keys[size]
+        vals[0] = vals[size]
+        i = 0
+        while True:
+            left = 2 * i + 1
+            if left >= size:
+                break
+            child = left
+            if left + 1 < size and keys[left + 1] < keys[left]:
+                child = left + 1
+            if keys[i] <= keys[child]:
+                break
+            keys[i], keys[child] = keys[child], keys[i]
+            vals[i], vals[child] = vals[child], vals[i]
+            i = child
+        return size
+
+    @njit(cache=True)
+    def _astar_njit(offsets, nbr_idx, nbr_w, xy, start, goal):
+        """A* over CSR arrays. Returns int32 array of node indices (empty if unreachable)."""
+        n = offsets.shape[0] - 1
+        gx = xy[goal, 0]
+        gy = xy[goal, 1]
+        gscore = np.full(n, np.inf)
+        came_from = np.full(n, -1, dtype=np.int32)
+        # lazy deletion: at most one push per relaxation plus the start node
+        keys = np.empty(nbr_idx.shape[0] + 1, dtype=np.float64)
+        vals = np.empty(nbr_idx.shape[0] + 1, dtype=np.int32)
+        gscore[start] = 0.0
+        size = _heap_push(keys, vals, 0,
+                          math.sqrt((xy[start, 0] - gx) ** 2 + (xy[start, 1] - gy) ** 2), start)
+        while size > 0:
+            f = keys[0]
+            u = vals[0]
+            size = _heap_pop(keys, vals, size)
+            if u == goal:
+                length = 1
+                v = u
+                while came_from[v] != -1:
+                    v = came_from[v]
+                    length += 1
+                path = np.empty(length, dtype=np.int32)
+                v = u
+                for k in range(length - 1, -1, -1):
+                    path[k] = v
+                    v = came_from[v]
+                return path
+            cost = gscore[u]
+            hu = math.sqrt((xy[u, 0] - gx) ** 2 + (xy[u, 1] - gy) ** 2)
+            if f > cost + hu:
+                continue  # stale entry
+            for k in range(offsets[u], offsets[u + 1]):
+                v = nbr_idx[k]
+                nc = cost + nbr_w[k]
+                if nc < gscore[v]:
+                    gscore[v] = nc
+                    came_from[v] = u
+                    h = math.sqrt((xy[v, 0] - gx) ** 2 + (xy[v, 1] - gy) ** 2)
+                    size = _heap_push(keys, vals, size, nc + h, v)
+        return np.empty(0, dtype=np.int32)
+
+
+def _astar_csr(csr, start, goal, traffic_counts=None):
+    """A* over CSR arrays with integer node indices. Returns list of indices or None."""
+    node_ids, _, offsets, nbr_idx, nbr_w, node_xy = csr
+    gx, gy = node_xy[goal]
+    counter = itertools.count()
+    sx, sy = node_xy[start]
+    pq = [(math.hypot(sx - gx, sy - gy), next(counter), 0.0, start)]
+    # node indices are dense 0..N-1, so per-node state lives in preallocated lists
+    n = len(node_ids)
+    gscore = [INF] * n
+    gscore[start] = 0.0
+    came_from = [-1] * n
+
+    while pq:
+        _, _, cost, u = heapq.heappop(pq)
+        if u == goal:
+            path = []
+            while u != -1:
+                path.append(u)
+                u = came_from[u]
+            path.reverse()
+            return path
+        if cost > gscore[u]:
+            continue
+        for k in range(offsets[u], offsets[u + 1]):
+            v = nbr_idx[k]
+            nc = cost + nbr_w[k]
+            if traffic_counts:
+                key = tuple(sorted((str(node_ids[u]), str(node_ids[v]))))
+                nc += traffic_counts.get(key, 0) * 10.0
+            if nc < gscore[v]:
+                gscore[v] = nc
+                came_from[v] = u
+                nx, ny = node_xy[v]
+                heapq.heappush(pq, (nc + math.hypot(nx - gx, ny - gy), next(counter), nc, v))
+    return None
+
+
+def find_path(nodes, edges, start_id, goal_id, traffic_counts=None, csr=None):
     """
-    Dijkstra pathfinder on the constructed graph.
+    A* pathfinder on the constructed graph.
+    nodes: dict node -> (x,y), used for the straight-line distance heuristic
     edges: dict node -> list of (neighbor, weight)
     nodes are opaque ids (strings or ints)
+    Edge weights are geometric distances (plus non-negative traffic penalty), so the
+    Euclidean distance to the goal never overestimates and the first pop of the goal is optimal.
+    csr: optional result of build_csr(nodes, edges); when given the search runs on the
+         index arrays instead of the dicts (build it once per map and reuse it)
     returns: list of node ids from start to goal (inclusive) or None if unreachable
     """
     if start_id not in edges or goal_id not in edges:
         return None
-    if traffic_counts is None:
-        traffic_counts = {}
-
-    pq = [(0.0, start_id, [start_id])]
-    seen = {}
+    if csr is not None:
+        node_ids, node_index = csr[0], csr[1]
+        if njit is not None and not traffic_counts:
+            path = _astar_njit(csr[2], csr[3], csr[4], csr[5],
+                               node_index[start_id], node_index[goal_id])
+            if len(path) == 0:
+                return None
+        else:
+            path = _astar_csr(csr, node_index[start_id], node_index[goal_id], traffic_counts)
+            if path is None:
+                return None
+        return [node_ids[i] for i in path]
+    gx, gy = nodes[goal_id]
+    counter = itertools.count()  # tiebreaker: never compare node ids (str vs int)
+    sx, sy = nodes[start_id]
+    pq = [(math.hypot(sx - gx, sy - gy), next(counter), 0.0, start_id)]
+    gscore = {start_id: 0.0}
+    came_from = {start_id: None}
 
     while pq:
-        cost, node, path = heapq.heappop(pq)
+        _, _, cost, node = heapq.heappop(pq)
         if node == goal_id:
+            path = []
+            while node is not None:
+                path.append(node)
+                node = came_from[node]
+            path.reverse()
             return path
-        if node in seen and seen[node] <= cost:
-            continue
-        seen[node] = cost
+        if cost > gscore[node]:
+            continue  # stale entry
         for nbr, w in edges.get(node, []):
-            key = tuple(sorted((str(node), str(nbr))))
-            t = traffic_counts.get(key, 0)
-            nc = cost + w + t * 10.0
-            if nbr not in seen or nc < seen.get(nbr, float('inf')):
-                heapq.heappush(pq, (nc, nbr, path + [nbr]))
+            nc = cost + w
+            if traffic_counts:
+                # only build the edge key when there is traffic to look up
+                key = tuple(sorted((str(node), str(nbr))))
+                nc += traffic_counts.get(key, 0) * 10.0
+            if nc < gscore.get(nbr, INF):
+                gscore[nbr] = nc
+                came_from[nbr] = node
+                nx, ny = nodes[nbr]
+                heapq.heappush(pq, (nc + math.hypot(nx - gx, ny - gy), next(counter), nc, nbr))
     return None
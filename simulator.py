@@ -1,9 +1,8 @@
 #!/usr/bin/env python3
 # simulator.py — Final Stable Version with Intersection Reservation System
-import sys, json, random, math, os
+import sys, json, random, math, os, pickle
 import pygame
-from pygame.math import Vector2
-from map_utils import load_map_data, build_graph, find_path
+from map_utils import load_map_data, build_graph, build_csr, find_path, GRAPH_CACHE_VERSION
 
 SCREEN_W, SCREEN_H = 1000, 700
 BG = (200, 220, 230)
@@ -13,6 +12,14 @@ HUB_COLOR = (255, 200, 0)
 CAR_COLOR = (30, 60, 200)
 LIGHT_GREEN = (0, 200, 0)
 LIGHT_RED = (200, 0, 0)
+GRID_CELL = 80  # spatial-hash cell size (px) >= largest light/symbol interaction radius
+CAR_SPEED, CAR_SPEED_JITTER = 80, 15  # px/s; each car gets CAR_SPEED +- jitter
+LANE_OFFSET = 5  # px a car sits off the centreline on 'big' roads
+LEADER_DIST = 25  # px look-ahead for the car in front
+# Car grid cell size (px). The grid is built before any car moves in a tick, so a car can
+# be up to max speed * dt + LANE_OFFSET (edge-change snap) away from its bucket;
+# Simulator.update widens the searched block when that exceeds one cell.
+CAR_CELL = 40
 
 # ------------------------------------------------------------
 class TrafficLight:
@@ -27,11 +34,11 @@ class TrafficLight:
     def update(self, dt):
         self.t += dt
 
-    def is_green_for(self, dir_vec):
+    def is_green_for(self, dir_x, dir_y):
         """Alternating horizontal/vertical green phase."""
         cycle = self.green + self.red
         phase = (self.t % cycle)
-        horizontal = abs(dir_vec.x) > abs(dir_vec.y)
+        horizontal = abs(dir_x) > abs(dir_y)
         if horizontal:
             # horizontal cars move first
             return phase < self.green
@@ -49,20 +56,42 @@ class Car:
         self.id = cid
         self.edge_idx = 0
         self.progress = 0.0
-        self.speed = 80 + random.uniform(-15, 15)
+        self.speed = CAR_SPEED + random.uniform(-CAR_SPEED_JITTER, CAR_SPEED_JITTER)
         self.radius = 6
         self.finished = False
         self.intersection_target = None
+        # path coordinates materialized once so the tick never goes back to the node dict
+        self.points = [self.nodes[n] for n in self.path]
+        # per-edge geometry, recomputed only when edge_idx changes (see _edge_geometry)
+        self._edge_cache_idx = -1
+        # position as plain floats: the tick does scalar math, no Vector2 allocations
         if self.path:
-            self.pos = Vector2(self.nodes[self.path[0]])
+            self.px, self.py = self.points[0]
         else:
-            self.pos = Vector2(0, 0)
+            self.px, self.py = 0.0, 0.0
 
     def current_edge(self):
         if self.edge_idx + 1 < len(self.path):
             return (self.path[self.edge_idx], self.path[self.edge_idx + 1])
         return None
 
+    def _edge_geometry(self):
+        """Cache start point, length, unit direction and road type of the current edge."""
+        ax, ay = self.points[self.edge_idx]
+        bx, by = self.points[self.edge_idx + 1]
+        ex, ey = bx - ax, by - ay
+        edge_len = math.hypot(ex, ey)
+        if edge_len != 0:
+            dx, dy = ex / edge_len, ey / edge_len
+        else:
+            edge_len = 1
+            dx, dy = 0.0, 0.0
+        self._ax, self._ay = ax, ay
+        self._len = edge_len
+        self._dx, self._dy = dx, dy
+        self._type = self.sim.get_edge_type((self.path[self.edge_idx], self.path[self.edge_idx + 1]))
+        self._edge_cache_idx = self.edge_idx
+
     def update(self, dt):
         if self.finished:
             return
@@ -70,25 +99,39 @@ class Car:
             self.finished = True
             return
 
-        a = Vector2(self.nodes[self.path[self.edge_idx]])
-        b = Vector2(self.nodes[self.path[self.edge_idx + 1]])
-        edge_vec = b - a
-        edge_len = edge_vec.length() if edge_vec.length() != 0 else 1
-        dir_vec = edge_vec.normalize()
-        road_type = self.sim.get_edge_type((self.path[self.edge_idx], self.path[self.edge_idx + 1]))
+        if self.edge_idx != self._edge_cache_idx:
+            self._edge_geometry()
+        ax, ay = self._ax, self._ay
+        edge_len = self._len
+        dx, dy = self._dx, self._dy
+        road_type = self._type
+        px, py = self.px, self.py
+
+        # No-entry ahead: the car holds this tick, so skip the leader/light work entirely
+        symbols = self.sim._query(self.sim.symbol_grid, (px, py))
+        for s in symbols:
+            if s.get('type') == 'no_entry':
+                sx, sy = s['x'] - px, s['y'] - py
+                if sx * dx + sy * dy > 0 and math.hypot(sx, sy) < 50:
+                    return
 
         # Maintain spacing
         leader = None
         min_gap = 1e9
-        for other in self.sim.cars:
-            if other is self or other.finished:
-                continue
-            rel = other.pos - self.pos
-            dist = rel.length()
-            if dist < 25 and rel.dot(dir_vec) > 0:
-                if dist < min_gap:
-                    min_gap = dist
-                    leader = other
+        car_grid = self.sim.car_grid
+        reach = self.sim.car_grid_reach
+        cx, cy = int(px // CAR_CELL), int(py // CAR_CELL)
+        for gx in range(cx - reach, cx + reach + 1):
+            for gy in range(cy - reach, cy + reach + 1):
+                for other in car_grid.get((gx, gy), ()):
+                    if other is self or other.finished:
+                        continue
+                    rx, ry = other.px - px, other.py - py
+                    dist = math.hypot(rx, ry)
+                    if dist < LEADER_DIST and rx * dx + ry * dy > 0:
+                        if dist < min_gap:
+                            min_gap = dist
+                            leader = other
         max_speed = self.speed
         if leader and min_gap < 18:
             max_speed = 0
@@ -96,42 +139,36 @@ class Car:
             max_speed = min(max_speed, self.speed * 0.5)
 
         # --- Traffic light + intersection reservation ---
-        for lt in self.sim.lights:
-            light_pos = Vector2(lt.x, lt.y)
-            to_light = light_pos - self.pos
-            dist = to_light.length()
-            if dist < 80 and to_light.dot(dir_vec) > 0:
-                stop_point = light_pos - dir_vec * 25
-
-                # if light red for this direction
-                if not lt.is_green_for(dir_vec):
-                    if (stop_point - self.pos).length() < 35:
+        for lt in self.sim._query(self.sim.light_grid, (px, py)):
+            tx, ty = lt.x - px, lt.y - py
+            dist = math.hypot(tx, ty)
+            if dist < 80 and tx * dx + ty * dy > 0:
+                green = lt.is_green_for(dx, dy)
+                # if light red for this direction (stop point is 25px before the light)
+                if not green:
+                    if math.hypot(tx - dx * 25, ty - dy * 25) < 35:
                         max_speed = 0
                 # check intersection reservation
                 if lt in self.sim.occupied and self.sim.occupied[lt] != self:
-                    if (light_pos - self.pos).length() < 60:
+                    if dist < 60:
                         max_speed = 0
                 # Reserve intersection if approaching & light green
-                if lt.is_green_for(dir_vec) and (light_pos - self.pos).length() < 40:
+                if green and dist < 40:
                     self.sim.occupied[lt] = self
                     self.intersection_target = lt
 
         # Release intersection after passing
         if self.intersection_target:
-            light_pos = Vector2(self.intersection_target.x, self.intersection_target.y)
-            if (self.pos - light_pos).length() > 60:
-                if self.sim.occupied.get(self.intersection_target) == self:
-                    self.sim.occupied.pop(self.intersection_target, None)
+            lt = self.intersection_target
+            if math.hypot(px - lt.x, py - lt.y) > 60:
+                if self.sim.occupied.get(lt) == self:
+                    self.sim.occupied.pop(lt, None)
                 self.intersection_target = None
 
-        # --- Symbol handling ---
-        for s in self.sim.symbols:
-            sym_vec = Vector2(s['x'], s['y']) - self.pos
-            dist = sym_vec.length()
-            if s.get('type') == 'slow' and dist < 50:
+        # --- Symbol handling (no_entry was handled above) ---
+        for s in symbols:
+            if s.get('type') == 'slow' and math.hypot(s['x'] - px, s['y'] - py) < 50:
                 max_speed = min(max_speed, 40)
-            elif s.get('type') == 'no_entry' and sym_vec.dot(dir_vec) > 0 and dist < 50:
-                return
 
         # Move
         move = max_speed * dt
@@ -140,24 +177,26 @@ class Car:
         if self.progress >= 1.0:
             self.edge_idx += 1
             if self.edge_idx + 1 >= len(self.path):
-                self.pos = Vector2(self.nodes[self.path[-1]])
+                self.px, self.py = self.points[-1]
                 self.finished = True
                 return
             self.progress = 0.0
-            a = Vector2(self.nodes[self.path[self.edge_idx]])
-            self.pos = a
+            self.px, self.py = self.points[self.edge_idx]
         else:
-            lane_offset = Vector2(0, 0)
+            ox, oy = 0.0, 0.0
             if road_type == 'big':
-                perp = Vector2(-dir_vec.y, dir_vec.x)
-                if abs(dir_vec.x) >= abs(dir_vec.y):
-                    lane_offset = perp * (5 if dir_vec.x > 0 else -5)
+                # offset along the perpendicular (-dy, dx)
+                if abs(dx) >= abs(dy):
+                    side = LANE_OFFSET if dx > 0 else -LANE_OFFSET
                 else:
-                    lane_offset = perp * (5 if dir_vec.y > 0 else -5)
-            self.pos = a + dir_vec * (self.progress * edge_len) + lane_offset
+                    side = LANE_OFFSET if dy > 0 else -LANE_OFFSET
+                ox, oy = -dy * side, dx * side
+            along = self.progress * edge_len
+            self.px = ax + dx * along + ox
+            self.py = ay + dy * along + oy
 
     def draw(self, surf):
-        pygame.draw.circle(surf, CAR_COLOR, (int(self.pos.x), int(self.pos.y)), self.radius)
+        pygame.draw.circle(surf, CAR_COLOR, (int(self.px), int(self.py)), self.radius)
 
 
 # ------------------------------------------------------------
@@ -168,24 +207,119 @@ class Simulator:
         pygame.display.set_caption('Traffic Simulator - Intersection Reservation')
         self.clock = pygame.time.Clock()
         self.map = load_map_data(mapfile)
-        self.nodes, self.edges = build_graph(self.map)
+        self.nodes, self.edges = self._load_graph(mapfile)
+        self.edge_type = self._build_edge_types(self.edges)  # (u, v) -> 'big' | 'small'
+        self.csr = build_csr(self.nodes, self.edges)
+        # compile (or load) the JIT pathfinder here, not on the first spawn inside run()
+        if self.edges:
+            nid = next(iter(self.edges))
+            find_path(self.nodes, self.edges, nid, nid, csr=self.csr)
         self.lights = [TrafficLight(l) for l in self.map.get('lights', [])]
         self.symbols = self.map.get('symbols', [])
+        self.light_grid = self._build_grid(self.lights, lambda lt: (lt.x, lt.y))
+        self.symbol_grid = self._build_grid(self.symbols, lambda s: (s['x'], s['y']))
         self.cars = []
+        self.car_grid = {}  # (cx, cy) -> [Car], rebuilt every tick in update()
+        self.car_grid_reach = 1  # cells to search around a car, see CAR_CELL
         self.next_car_id = 1
         self.spawn_mode = False
         self.spawn_click = []
         self.occupied = {}  # intersection reservation {TrafficLight: Car}
+        self._path_cache = {}  # (start_id, end_id) -> path tuple or None; map is static
+        # auto-spawn as a Poisson process per hub: next spawn times instead of a per-tick roll
+        hubs = self.map.get('hubs', [])
+        self.sim_time = 0.0
+        self.spawn_rate = {h['id']: h.get('rate', 1) / 60.0 for h in hubs}  # cars per second
+        self.next_spawn = {hid: self._spawn_interval(hid) for hid in self.spawn_rate}
+        self.other_hubs = {h['id']: tuple(x['id'] for x in hubs if x['id'] != h['id']) for h in hubs}
+        # fonts and static text are rendered once, not every frame
+        self._font_small = pygame.font.SysFont(None, 18)
+        self._font_hud = pygame.font.SysFont(None, 20)
+        self._hub_label_surfs = {h['id']: self._font_small.render(h.get('name', ''), True, (0, 0, 0))
+                                 for h in self.map.get('hubs', [])}
+        self._hud_key = None  # (spawn_mode, car count) the cached HUD surface was rendered for
+        self._hud_surf = None
+        self.background = self._render_background()  # map never changes during a run
+
+    @staticmethod
+    def _build_grid(items, pos_of):
+        """Bucket static items by GRID_CELL cell; entries keep their list order for _query."""
+        grid = {}
+        for order, item in enumerate(items):
+            x, y = pos_of(item)
+            grid.setdefault((int(x // GRID_CELL), int(y // GRID_CELL)), []).append((order, item))
+        return grid
+
+    def _query(self, grid, pos, cells=1):
+        """Items in the (2*cells+1)^2 block of grid cells around pos, in original list order."""
+        cx, cy = int(pos[0] // GRID_CELL), int(pos[1] // GRID_CELL)
+        found = []
+        for dx in range(-cells, cells + 1):
+            for dy in range(-cells, cells + 1):
+                bucket = grid.get((cx + dx, cy + dy))
+                if bucket:
+                    found.extend(bucket)
+        if len(found) > 1:
+            found.sort(key=lambda e: e[0])
+        return [item for _, item in found]
+
+    def _load_graph(self, mapfile):
+        """Return (nodes, edges) for the map, reusing mapfile + '.cache' when it is
+        at least as new as the map file and was written for the current
+        map_utils.GRAPH_CACHE_VERSION; otherwise build the graph and (re)write the cache.
+        The cache is a pickle: loading it can run arbitrary code, so only use maps from
+        folders you trust (delete the .cache file if in doubt)."""
+        cache_path = mapfile + '.cache'
+        try:
+            if os.path.getmtime(cache_path) >= os.path.getmtime(mapfile):
+                with open(cache_path, 'rb') as f:
+                    version, graph = pickle.load(f)
+                if version == GRAPH_CACHE_VERSION:
+                    return graph
+        except Exception:
+            pass  # missing, unreadable or incompatible cache: rebuild below
+        graph = build_graph(self.map)
+        try:
+            with open(cache_path, 'wb') as f:
+                pickle.dump((GRAPH_CACHE_VERSION, graph), f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            pass  # read-only location: just run without a cache
+        return graph
+
+    def _build_edge_types(self, edges):
+        """Map every graph edge (u, v) to its road type, once per map.
+        Road nodes are named r{rid}_X; an edge takes the type of the first road in the
+        map's list that owns either endpoint (intersection/hub nodes belong to none)."""
+        roads_by_id = {}  # str(rid) -> (list order, type)
+        for order, r in enumerate(self.map.get('roads', [])):
+            roads_by_id.setdefault(str(r['id']), (order, r.get('type', 'small')))
+
+        def road_of(nid):
+            if isinstance(nid, str) and nid.startswith('r'):
+                return roads_by_id.get(nid[1:nid.rfind('_')])
+            return None
+
+        edge_type = {}
+        for u, nbrs in edges.items():
+            for v, _ in nbrs:
+                owners = [o for o in (road_of(u), road_of(v)) if o is not None]
+                if owners:
+                    edge_type[(u, v)] = min(owners)[1]
+        return edge_type
 
     def get_edge_type(self, edge):
-        for r in self.map.get('roads', []):
-            rid = r['id']
-            if f"r{rid}_" in str(edge[0]) or f"r{rid}_" in str(edge[1]):
-                return r.get('type', 'small')
-        return 'small'
+        return self.edge_type.get(edge, 'small')
 
     def spawn_car(self, start_id, end_id):
-        path = find_path(self.edges, start_id, end_id, traffic_counts=None)
+        key = (start_id, end_id)
+        if key in self._path_cache:
+            path = self._path_cache[key]
+        else:
+            # routing ignores traffic, so the pair alone is a valid key
+            path = find_path(self.nodes, self.edges, start_id, end_id, traffic_counts=None, csr=self.csr)
+            if path is not None:
+                path = tuple(path)
+            self._path_cache[key] = path
         if not path or len(path) < 2:
             return False
         car = Car(path, self.nodes, self, self.next_car_id)
@@ -193,50 +327,78 @@ class Simulator:
         self.cars.append(car)
         return True
 
+    def _spawn_interval(self, hid):
+        rate = self.spawn_rate[hid]
+        return random.expovariate(rate) if rate > 0 else float('inf')
+
+    def auto_spawn(self, dt):
+        """Spawn one car from every hub whose next scheduled spawn time has passed."""
+        self.sim_time += dt
+        for hid, t in self.next_spawn.items():
+            if t <= self.sim_time:
+                self.next_spawn[hid] = t + self._spawn_interval(hid)
+                if self.other_hubs[hid]:
+                    self.spawn_car(hid, random.choice(self.other_hubs[hid]))
+
     def update(self, dt):
         for lt in self.lights:
             lt.update(dt)
-        for car in list(self.cars):
+        car_grid = {}
+        for car in self.cars:
+            car_grid.setdefault((int(car.px // CAR_CELL), int(car.py // CAR_CELL)), []).append(car)
+        self.car_grid = car_grid
+        # largest distance a car can drift from its bucket this tick, plus the look-ahead
+        max_reach = LEADER_DIST + (CAR_SPEED + CAR_SPEED_JITTER) * dt + LANE_OFFSET
+        self.car_grid_reach = max(1, math.ceil(max_reach / CAR_CELL))
+        for car in self.cars:
             car.update(dt)
-            if car.finished:
-                self.cars.remove(car)
+        if any(c.finished for c in self.cars):
+            self.cars = [c for c in self.cars if not c.finished]
 
-    def draw(self):
-        self.screen.fill(BG)
+    def _render_background(self):
+        """Draw the static parts of the map (roads, hubs, labels, symbols) once."""
+        bg = self.screen.copy()
+        bg.fill(BG)
         for r in self.map.get('roads', []):
-            pygame.draw.rect(self.screen, ROAD_COLOR, (r['x'], r['y'], r['w'], r['h']))
+            pygame.draw.rect(bg, ROAD_COLOR, (r['x'], r['y'], r['w'], r['h']))
             if r.get('type') == 'big':
                 if r['w'] >= r['h']:
                     y_mid = r['y'] + r['h'] / 2
-                    pygame.draw.line(self.screen, LANE_COLOR, (r['x'], y_mid), (r['x'] + r['w'], y_mid), 2)
+                    pygame.draw.line(bg, LANE_COLOR, (r['x'], y_mid), (r['x'] + r['w'], y_mid), 2)
                 else:
                     x_mid = r['x'] + r['w'] / 2
-                    pygame.draw.line(self.screen, LANE_COLOR, (x_mid, r['y']), (x_mid, r['y'] + r['h']), 2)
+                    pygame.draw.line(bg, LANE_COLOR, (x_mid, r['y']), (x_mid, r['y'] + r['h']), 2)
 
         for h in self.map.get('hubs', []):
-            pygame.draw.circle(self.screen, HUB_COLOR, (int(h['x']), int(h['y'])), 12)
-            font = pygame.font.SysFont(None, 18)
-            txt = font.render(h.get('name', ''), True, (0, 0, 0))
-            self.screen.blit(txt, (h['x'] - txt.get_width() / 2, h['y'] - 25))
-
-        for lt in self.lights:
-            col = LIGHT_GREEN if lt.t % (lt.green + lt.red) < lt.green else LIGHT_RED
-            pygame.draw.circle(self.screen, col, (int(lt.x), int(lt.y)), 8)
+            pygame.draw.circle(bg, HUB_COLOR, (int(h['x']), int(h['y'])), 12)
+            txt = self._hub_label_surfs[h['id']]
+            bg.blit(txt, (h['x'] - txt.get_width() / 2, h['y'] - 25))
 
         for s in self.symbols:
             if s.get('type') == 'slow':
-                pygame.draw.rect(self.screen, (150, 150, 150), (s['x'] - 10, s['y'] - 6, 20, 12))
+                pygame.draw.rect(bg, (150, 150, 150), (s['x'] - 10, s['y'] - 6, 20, 12))
             elif s.get('type') == 'no_entry':
-                pygame.draw.circle(self.screen, (220, 50, 50), (int(s['x']), int(s['y'])), 8)
-                pygame.draw.line(self.screen, (255, 255, 255),
+                pygame.draw.circle(bg, (220, 50, 50), (int(s['x']), int(s['y'])), 8)
+                pygame.draw.line(bg, (255, 255, 255),
                                  (s['x'] - 5, s['y']), (s['x'] + 5, s['y']), 2)
+        return bg
+
+    def draw(self):
+        self.screen.blit(self.background, (0, 0))
+
+        for lt in self.lights:
+            col = LIGHT_GREEN if lt.t % (lt.green + lt.red) < lt.green else LIGHT_RED
+            pygame.draw.circle(self.screen, col, (int(lt.x), int(lt.y)), 8)
 
         for c in self.cars:
             c.draw(self.screen)
 
-        font = pygame.font.SysFont(None, 20)
-        txt = font.render(f"Spawn(S): {'ON' if self.spawn_mode else 'OFF'}  Cars: {len(self.cars)}", True, (0, 0, 0))
-        self.screen.blit(txt, (10, 10))
+        hud_key = (self.spawn_mode, len(self.cars))
+        if hud_key != self._hud_key:
+            self._hud_key = hud_key
+            self._hud_surf = self._font_hud.render(
+                f"Spawn(S): {'ON' if self.spawn_mode else 'OFF'}  Cars: {len(self.cars)}", True, (0, 0, 0))
+        self.screen.blit(self._hud_surf, (10, 10))
         pygame.display.flip()
 
     def run(self):
@@ -261,11 +423,7 @@ class Simulator:
                             self.spawn_car(self.spawn_click[0], self.spawn_click[1])
                             self.spawn_click = []
 
-            for h in self.map.get('hubs', []):
-                rate = h.get('rate', 1) / 60.0
-                if random.random() < rate * dt:
-                    dst = random.choice([x for x in self.map.get('hubs', []) if x['id'] != h['id']])
-                    self.spawn_car(h['id'], dst['id'])
+            self.auto_spawn(dt)
 
             self.update(dt)
             self.draw()